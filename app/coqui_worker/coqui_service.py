@@ -1,41 +1,86 @@
-import os, io, base64, re, numpy as np, soundfile as sf, uuid
-from typing import Dict, Any, List
+import os, io, base64, contextlib, numpy as np, soundfile as sf, soxr, uuid, torch
+from typing import Dict, Any, List, Iterator
 from pydub import AudioSegment
 from abc import ABC, abstractmethod
+from pathlib import Path
 from TTS.api import TTS  # Coqui TTS API
 
 SAMPLE_RATE = 16000
+WARMUP_TEXT = "This is a short sentence to warm up the model."
+
+def _decode_with_pydub(path: str):
+    audio = AudioSegment.from_file(path)
+    y = np.array(audio.get_array_of_samples(), dtype=np.float32)
+    y /= float(1 << (8 * audio.sample_width - 1))
+    if audio.channels > 1:
+        y = y.reshape(-1, audio.channels).mean(axis=1)
+    return y, audio.frame_rate
 
 def _load_to_mono16k_any(path: str) -> str:
+    """Return path to a mono 16 kHz PCM16 WAV version of the audio, `path` itself if it already is one"""
     try:
-        y, sr = sf.read(path, dtype="float32", always_2d=False)
-        if y.ndim > 1: y = y.mean(axis=1)
-        if sr != SAMPLE_RATE:
-            audio = AudioSegment.from_file(path)
-            audio = audio.set_frame_rate(SAMPLE_RATE)
-            y = np.array(audio.get_array_of_samples(), dtype=np.float32)
-            if audio.channels > 1:
-                y = y.reshape(-1, audio.channels).mean(axis=1)
-        tmp = io.BytesIO()
-        sf.write(tmp, y, SAMPLE_RATE, format="WAV", subtype="PCM_16")
-        tmp.seek(0)
-        tmp_path = f"/tmp/coqui_ref_{uuid.uuid4()}.wav"
-        with open(tmp_path, "wb") as f:
-            f.write(tmp.read())
-        return tmp_path
+        info = sf.info(path)
+        if (info.format, info.subtype, info.channels, info.samplerate) == ("WAV", "PCM_16", 1, SAMPLE_RATE):
+            return path
+        if info.subtype.startswith("PCM_"):
+            y, sr = sf.read(path, dtype="int16", always_2d=True)
+            # Downmix in integers, keeps the buffer 16-bit instead of promoting to float32
+            if y.shape[1] > 1:
+                y = (y.sum(axis=1, dtype=np.int32) // y.shape[1]).astype(np.int16)
+            else:
+                y = y[:, 0]
+        else:
+            # FLOAT/DOUBLE aren't rescaled by an int16 read, [-1, 1] samples would truncate to 0
+            y, sr = sf.read(path, dtype="float32", always_2d=True)
+            y = y.mean(axis=1, dtype=np.float32)
     except Exception:
-        pass
+        # soundfile can't open browser recordings (webm/m4a), decode via ffmpeg
+        y, sr = _decode_with_pydub(path)
 
-    audio = AudioSegment.from_file(path)
-    audio = audio.set_channels(1).set_frame_rate(SAMPLE_RATE)
-    out_path = f"/tmp/coqui_ref_{uuid.uuid4()}.wav"
-    audio.export(out_path, format="wav")
-    return out_path
+    if sr != SAMPLE_RATE:
+        # soxr takes int16 and float32 alike and returns the same dtype
+        y = soxr.resample(y, sr, SAMPLE_RATE, quality="HQ")
+
+    tmp_path = f"/tmp/coqui_ref_{uuid.uuid4()}.wav"
+    sf.write(tmp_path, y, SAMPLE_RATE, format="WAV", subtype="PCM_16")
+    return tmp_path
+
+def to_pcm16_bytes(wav) -> bytes:
+    if torch.is_tensor(wav):
+        wav = wav.float().cpu().numpy()
+    return (np.clip(wav, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+def _cpu_has_native_bf16() -> bool:
+    # Without bf16 instructions autocast emulates bf16 matmuls, which is slower than plain fp32
+    try:
+        cpuinfo = Path("/proc/cpuinfo").read_text()
+    except OSError:
+        return False
+    for line in cpuinfo.splitlines():
+        # "flags" on x86 (avx512_bf16, amx_bf16), "Features" on ARM (bf16 on Neoverse V1/V2, Graviton3+)
+        if line.startswith(("flags", "Features")):
+            flags = set(line.split(":", 1)[1].split())
+            return bool(flags & {"avx512_bf16", "amx_bf16", "bf16"})
+    return False
+
+def cpu_supports_bf16() -> bool:
+    return os.getenv("COQUI_BF16", "1") == "1" and _cpu_has_native_bf16()
+
+def run_in_fp32(forward):
+    """Wrap a module forward so it runs in float32 even inside a bf16 autocast region"""
+    def wrapper(*args, **kwargs):
+        args = [a.float() if torch.is_tensor(a) else a for a in args]
+        kwargs = {k: v.float() if torch.is_tensor(v) else v for k, v in kwargs.items()}
+        with torch.autocast(device_type="cpu", enabled=False):
+            return forward(*args, **kwargs)
+    return wrapper
 
 class CoquiTTSService(ABC):
     def __init__(self):
         self.tts = None
         self.speakers: List[str] = []
+        self._languages: List[str] = ['en']
+        self.use_bf16 = False
 
     @abstractmethod
     def get_model_name(self) -> str:
@@ -49,37 +94,95 @@ class CoquiTTSService(ABC):
         model_name = self.get_model_name()
         service_name = self.get_service_name()
         print(f"Loading {service_name} model: {model_name} (CPU)…")
+        torch.set_num_threads(int(os.getenv("COQUI_NUM_THREADS", os.cpu_count())))
+        torch.set_float32_matmul_precision("high")
         self.tts = TTS(
             model_name=model_name, 
             progress_bar=False, 
             gpu=False
         )
-        print(f"{service_name} ready.")
+        self._freeze_model()
         
         self._load_builtin_speakers()
+        self.use_bf16 = self._enable_bf16()
+        self._compile_model()
+        print(f"{service_name} ready.{' (bf16)' if self.use_bf16 else ''}")
+
+    def _freeze_model(self):
+        # Inference only, no autograd bookkeeping or dropout
+        torch.set_grad_enabled(False)
+        model = self.tts.synthesizer.tts_model
+        model.eval()
+        for param in model.parameters():
+            param.requires_grad_(False)
+
+    def _enable_bf16(self) -> bool:
+        """Prepare the model for bf16 autocast, return False if it should stay in fp32"""
+        return False
+
+    def _inference_context(self):
+        stack = contextlib.ExitStack()
+        stack.enter_context(torch.inference_mode())
+        if self.use_bf16:
+            stack.enter_context(torch.autocast(device_type="cpu", dtype=torch.bfloat16))
+        return stack
+
+    def _get_compile_target(self):
+        """Submodule whose forward dominates inference time, or None to skip compilation"""
+        return None
+
+    def _compile_model(self):
+        module = self._get_compile_target()
+        if module is None or os.getenv("COQUI_TORCH_COMPILE", "1") != "1":
+            return
+        
+        eager_forward = module.forward
+        try:
+            print(f"Compiling {self.get_service_name()} with torch.compile…")
+            # KV cache grows every decoding step, so shapes have to stay dynamic
+            module.forward = torch.compile(eager_forward, mode="reduce-overhead", dynamic=True)
+            self._warmup()
+        except Exception as e:
+            print(f"torch.compile failed, falling back to eager mode: {e}")
+            module.forward = eager_forward
+
+    def _warmup(self):
+        speaker = self.speakers[0] if self.speakers else None
+        language = self.get_supported_languages()[0]
+        # First run compiles the graph, second one runs it
+        for _ in range(2):
+            with self._inference_context():
+                self.tts.tts(text=WARMUP_TEXT, speaker=speaker, language=language)
 
     def _load_builtin_speakers(self):
-        if hasattr(self.tts, 'speakers') and self.tts.speakers:
+        if getattr(self.tts, 'speakers', None):
             self.speakers = list(self.tts.speakers)
+        if getattr(self.tts, 'languages', None):
+            self._languages = list(self.tts.languages)
 
     def get_available_speakers(self) -> List[str]:
         return self.speakers
     
     def get_supported_languages(self) -> List[str]:
-        if hasattr(self.tts, 'languages') and self.tts.languages:
-            return list(self.tts.languages)
-        return ['en']
+        return self._languages
 
-    def _read_and_cleanup_audio_file(self, out_path: str) -> bytes:
-        try:
-            y, sr = sf.read(out_path, dtype="float32")
-            buf = io.BytesIO()
-            sf.write(buf, y, sr, format="WAV", subtype="PCM_16")
-            buf.seek(0)
-            return buf.getvalue()
-        finally:
-            if os.path.exists(out_path):
-                os.unlink(out_path)
+    def _to_wav_bytes(self, wav) -> bytes:
+        buf = io.BytesIO()
+        sf.write(
+            buf,
+            np.asarray(wav, dtype=np.float32),
+            self.get_sample_rate(),
+            format="WAV",
+            subtype="PCM_16"
+        )
+        return buf.getvalue()
+
+    def get_sample_rate(self) -> int:
+        return self.tts.synthesizer.output_sample_rate
+
+    def stream_by_audio(self, text: str, speaker_wav_path: str, language: str = "en") -> Iterator[bytes]:
+        """Models without incremental decoding send the whole utterance as a single PCM16 chunk"""
+        yield to_pcm16_bytes(self._tts_by_audio(text, speaker_wav_path, language))
 
     def synthesize_by_speaker(self, text: str, speaker_id: str, language: str = "en") -> bytes:
         if not self.speakers:
@@ -88,35 +191,36 @@ class CoquiTTSService(ABC):
         if speaker_id not in self.speakers:
             raise ValueError(f"Unknown speaker: {speaker_id}. Available: {list(self.speakers.keys())}")
         
-        out_path = f"/tmp/{self.get_service_name().lower()}_out_{uuid.uuid4()}.wav"
         try:
-            self.tts.tts_to_file(
-                text=text,
-                speaker=speaker_id,
-                language=language,
-                file_path=out_path
-            )
+            with self._inference_context():
+                wav = self.tts.tts(
+                    text=text,
+                    speaker=speaker_id,
+                    language=language
+                )
         except Exception as e:
             print(f"Failed with speaker parameter, trying without: {e}")
-            self.tts.tts_to_file(
-                text=text,
-                language=language,
-                file_path=out_path
-            )
+            with self._inference_context():
+                wav = self.tts.tts(
+                    text=text,
+                    language=language
+                )
         
-        return self._read_and_cleanup_audio_file(out_path)
+        return self._to_wav_bytes(wav)
 
-    def synthesize_by_audio(self, text: str, speaker_wav_path: str, language: str = "en") -> bytes:
+    def _tts_by_audio(self, text: str, speaker_wav_path: str, language: str = "en"):
         ref_path = _load_to_mono16k_any(speaker_wav_path)
         
-        out_path = f"/tmp/{self.get_service_name().lower()}_out_{uuid.uuid4()}.wav"
-        self.tts.tts_to_file(
-            text=text,
-            speaker_wav=ref_path,
-            language=language,
-            file_path=out_path
-        )
-        
-        return self._read_and_cleanup_audio_file(out_path)
-
+        try:
+            with self._inference_context():
+                return self.tts.tts(
+                    text=text,
+                    speaker_wav=ref_path,
+                    language=language
+                )
+        finally:
+            if ref_path != speaker_wav_path:
+                os.unlink(ref_path)
 
+    def synthesize_by_audio(self, text: str, speaker_wav_path: str, language: str = "en") -> bytes:
+        return self._to_wav_bytes(self._tts_by_audio(text, speaker_wav_path, language))
@@ -1,18 +1,42 @@
 #!/usr/bin/env python3
 
-import json
+import orjson
 import time
 import os
 import sys
+import signal
+import socket
+import struct
+import torch.multiprocessing as mp
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Union
 
 sys.path.append('/app')
 
 from coqui_worker.xtts_service import xtts_service
 from coqui_worker.yourtts_service import yourtts_service
 
-def write_worker_info():
+SOCKET_PATH = "/tmp/tts_coqui.sock"
+NUM_PROCESSES = int(os.getenv("COQUI_WORKER_PROCESSES", "1"))
+
+def _recv_exact(conn: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = conn.recv(size - len(buf))
+        if not chunk:
+            raise ConnectionError("Connection closed before full message was received")
+        buf.extend(chunk)
+    return bytes(buf)
+
+def recv_frame(conn: socket.socket) -> bytes:
+    (length,) = struct.unpack("!I", _recv_exact(conn, 4))
+    return _recv_exact(conn, length)
+
+def send_frame(conn: socket.socket, data: bytes):
+    conn.sendall(struct.pack("!I", len(data)))
+    conn.sendall(data)
+
+def write_worker_info(write_file: bool = True):
     try:
         print("Loading XTTS model...")
         xtts_service.load_models()
@@ -46,8 +70,9 @@ def write_worker_info():
             }
         }
         
-        with open("/tmp/coqui.info", 'w') as f:
-            json.dump(info, f, indent=2)
+        if write_file:
+            with open("/tmp/coqui.info", 'wb') as f:
+                f.write(orjson.dumps(info, option=orjson.OPT_INDENT_2))
         
         print("Coqui worker ready.")
         print(f"XTTS: {len(xtts_languages)} languages, {len(xtts_speakers)} speakers")
@@ -60,11 +85,17 @@ def write_worker_info():
             "error": str(e),
             "models": {}
         }
-        with open("/tmp/coqui.info", 'w') as f:
-            json.dump(error_info, f, indent=2)
+        if write_file:
+            with open("/tmp/coqui.info", 'wb') as f:
+                f.write(orjson.dumps(error_info, option=orjson.OPT_INDENT_2))
         raise
 
-def process_job(job_data: Dict[str, Any]) -> tuple[bool, str]:
+def get_service(model: str):
+    if "your_tts" in model:
+        return yourtts_service
+    return xtts_service
+
+def process_job(job_data: Dict[str, Any]) -> tuple[bool, Union[bytes, str]]:
     try:
         job_id = job_data["id"]
         text = job_data["text"]
@@ -73,10 +104,7 @@ def process_job(job_data: Dict[str, Any]) -> tuple[bool, str]:
         
         print(f"Processing Coqui job {job_id} with {model}: '{text[:50]}...'")
         
-        if "your_tts" in model:
-            service = yourtts_service
-        else:
-            service = xtts_service
+        service = get_service(model)
         
         if "speaker" in job_data:
             speaker = job_data["speaker"]
@@ -88,71 +116,106 @@ def process_job(job_data: Dict[str, Any]) -> tuple[bool, str]:
         else:
             return False, "No speaker or reference audio provided"
         
-        output_path = f"/tmp/tts_out/{job_id}.wav"
-        with open(output_path, 'wb') as f:
-            f.write(audio_bytes)
-        
-        with open(f"/tmp/tts_done/{job_id}.ok", 'w') as f:
-            f.write("Success")
-        
         print(f"Job {job_id} completed successfully")
-        return True, "Success"
+        return True, audio_bytes
         
     except Exception as e:
         error_msg = f"Coqui synthesis failed: {str(e)}"
         print(f"Job {job_data.get('id', 'unknown')} failed: {error_msg}")
-        
-        job_id = job_data.get("id", "unknown")
-        with open(f"/tmp/tts_done/{job_id}.err", 'w') as f:
-            f.write(error_msg)
-        
         return False, error_msg
 
+def stream_job(conn: socket.socket, job_data: Dict[str, Any]):
+    """Send a status frame, then PCM16 chunk frames as they are decoded, then an empty frame"""
+    job_id = job_data["id"]
+    ref_wav_path = job_data.get("ref_wav")
+    try:
+        try:
+            if not ref_wav_path:
+                raise ValueError("Streaming requires reference audio (ref_wav)")
+            
+            service = get_service(job_data.get("model", "xtts"))
+            print(f"Streaming Coqui job {job_id}: '{job_data['text'][:50]}...'")
+            chunks = service.stream_by_audio(job_data["text"], ref_wav_path, job_data.get("language", "en"))
+            # Pull the first chunk before replying so setup errors still reach the gateway as a status
+            first_chunk = next(chunks, b"")
+        except Exception as e:
+            error_msg = f"Coqui streaming failed: {str(e)}"
+            print(f"Job {job_id} failed: {error_msg}")
+            send_frame(conn, orjson.dumps({"ok": False, "error": error_msg}))
+            return
+        
+        send_frame(conn, orjson.dumps({"ok": True, "sample_rate": service.get_sample_rate()}))
+        if first_chunk:
+            send_frame(conn, first_chunk)
+            for chunk in chunks:
+                # Empty frame terminates the stream, never send one mid-stream
+                if chunk:
+                    send_frame(conn, chunk)
+        send_frame(conn, b"")
+        print(f"Completed streaming job {job_id}")
+    finally:
+        if ref_wav_path:
+            Path(ref_wav_path).unlink(missing_ok=True)
+
+def handle_connection(conn: socket.socket):
+    request = orjson.loads(recv_frame(conn))
+    
+    if request.get("stream"):
+        stream_job(conn, request)
+        return
+    
+    success, result = process_job(request)
+    
+    if success:
+        send_frame(conn, orjson.dumps({"ok": True}))
+        send_frame(conn, result)
+        print(f"Completed job {request['id']}")
+    else:
+        send_frame(conn, orjson.dumps({"ok": False, "error": result}))
+        print(f"Failed job {request['id']}: {result}")
+
 def main():
     print("Starting Coqui Worker...")
     print(f"Python path: {sys.path}")
     print(f"Current working directory: {os.getcwd()}")
     print(f"Files in /app: {os.listdir('/app')}")
     
-    try:
-        write_worker_info()
-    except Exception as e:
-        print(f"Failed to initialize Coqui worker: {e}")
-        import traceback
-        traceback.print_exc()
-        return 1
+    # Listen before loading the models, requests arriving during a restart wait in the backlog
+    # instead of failing to connect
+    Path(SOCKET_PATH).unlink(missing_ok=True)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(SOCKET_PATH)
+    server.listen(16)
     
-    queue_dir = Path("/tmp/tts_queue/coqui")
-    queue_dir.mkdir(parents=True, exist_ok=True)
-    
-    print("Coqui Worker ready. Monitoring for jobs...")
+    try:
+        if NUM_PROCESSES > 1:
+            return serve_forked(server, NUM_PROCESSES)
+        
+        try:
+            write_worker_info()
+        except Exception as e:
+            print(f"Failed to initialize Coqui worker: {e}")
+            import traceback
+            traceback.print_exc()
+            return 1
+        
+        print(f"Coqui Worker ready. Listening for jobs on {SOCKET_PATH}...")
+        serve(server)
+    finally:
+        server.close()
+        Path(SOCKET_PATH).unlink(missing_ok=True)
     
+    return 0
+
+def serve(server: socket.socket):
     while True:
         try:
-            job_files = list(queue_dir.glob("job_*.json"))
-            
-            for job_file in job_files:
+            conn, _ = server.accept()
+            with conn:
                 try:
-                    with open(job_file, 'r') as f:
-                        job_data = json.load(f)
-                    
-                    success, message = process_job(job_data)
-                    
-                    job_file.unlink()
-                    
-                    if success:
-                        print(f"Completed job {job_data['id']}")
-                    else:
-                        print(f"Failed job {job_data['id']}: {message}")
-                        
+                    handle_connection(conn)
                 except Exception as e:
-                    print(f"Error processing job file {job_file}: {e}")
-                    try:
-                        job_file.unlink()
-                    except:
-                        pass
-            
-            time.sleep(0.1)
+                    print(f"Error handling job connection: {e}")
             
         except KeyboardInterrupt:
             print("Coqui Worker shutting down...")
@@ -160,7 +223,45 @@ def main():
         except Exception as e:
             print(f"Unexpected error in Coqui worker: {e}")
             time.sleep(1)
+
+def _serve_child(server: socket.socket, num_threads: int, write_info: bool):
+    # load_models reads COQUI_NUM_THREADS
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["COQUI_NUM_THREADS"] = str(num_threads)
+    try:
+        write_worker_info(write_file=write_info)
+    except Exception as e:
+        print(f"Failed to initialize Coqui worker process {os.getpid()}: {e}")
+        sys.exit(1)
+    
+    print(f"Coqui worker process {os.getpid()} listening on {SOCKET_PATH} with {num_threads} threads")
+    serve(server)
+
+def serve_forked(server: socket.socket, num_processes: int) -> int:
+    """Fork processes that each load the models and accept jobs from the same socket"""
+    # Fork before any torch compute: an OpenMP thread pool started in the parent is unusable
+    # in forked children, so each child loads its own copy of the models
+    ctx = mp.get_context("fork")
+    num_threads = max(1, (os.cpu_count() or 1) // num_processes)
+    # Only the first process writes /tmp/coqui.info so the children don't race on the file
+    processes = [
+        ctx.Process(target=_serve_child, args=(server, num_threads, i == 0), daemon=True)
+        for i in range(num_processes)
+    ]
+    for process in processes:
+        process.start()
     
+    # Exit through SystemExit on SIGTERM so daemonic children get terminated too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while True:
+            if not all(process.is_alive() for process in processes):
+                # Exit so supervisord restarts the whole worker, the others get terminated with us
+                print("A Coqui worker process died, shutting down")
+                return 1
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Coqui Worker shutting down...")
     return 0
 
 if __name__ == "__main__":
@@ -1,10 +1,102 @@
-from .coqui_service import CoquiTTSService
+import os
+import xxhash
+from collections import OrderedDict
+from typing import Iterator
+from .coqui_service import CoquiTTSService, _load_to_mono16k_any, cpu_supports_bf16, run_in_fp32, to_pcm16_bytes
+
+COND_LATENTS_CACHE_SIZE = 32
 
 class XTTSService(CoquiTTSService):
+    def __init__(self):
+        super().__init__()
+        self._cond_latents_cache: OrderedDict = OrderedDict()
+
     def get_model_name(self) -> str:
         return "tts_models/multilingual/multi-dataset/xtts_v2"
     
     def get_service_name(self) -> str:
         return "XTTS"
+    
+    def _enable_bf16(self) -> bool:
+        if not cpu_supports_bf16():
+            return False
+        # HiFi-GAN output is converted straight to numpy, which has no bfloat16
+        vocoder = self.tts.synthesizer.tts_model.hifigan_decoder
+        vocoder.forward = run_in_fp32(vocoder.forward)
+        return True
+    
+    def _get_compile_target(self):
+        # Autoregressive GPT decoder, called once per generated token
+        return self.tts.synthesizer.tts_model.gpt.gpt_inference
+
+    def _get_conditioning_latents(self, speaker_wav_path: str):
+        with open(speaker_wav_path, "rb") as f:
+            key = xxhash.xxh3_64_hexdigest(f.read())
+        
+        latents = self._cond_latents_cache.get(key)
+        if latents is not None:
+            self._cond_latents_cache.move_to_end(key)
+            print("Using cached conditioning latents")
+            return latents
+        
+        model = self.tts.synthesizer.tts_model
+        ref_path = _load_to_mono16k_any(speaker_wav_path)
+        try:
+            with self._inference_context():
+                latents = model.get_conditioning_latents(
+                    audio_path=ref_path,
+                    gpt_cond_len=model.config.gpt_cond_len,
+                    gpt_cond_chunk_len=model.config.gpt_cond_chunk_len,
+                    max_ref_length=model.config.max_ref_len,
+                    sound_norm_refs=model.config.sound_norm_refs
+                )
+        finally:
+            if ref_path != speaker_wav_path:
+                os.unlink(ref_path)
+        
+        self._cond_latents_cache[key] = latents
+        if len(self._cond_latents_cache) > COND_LATENTS_CACHE_SIZE:
+            self._cond_latents_cache.popitem(last=False)
+        return latents
+
+    def synthesize_by_audio(self, text: str, speaker_wav_path: str, language: str = "en") -> bytes:
+        gpt_cond_latent, speaker_embedding = self._get_conditioning_latents(speaker_wav_path)
+        
+        model = self.tts.synthesizer.tts_model
+        with self._inference_context():
+            out = model.inference(
+                text,
+                language,
+                gpt_cond_latent,
+                speaker_embedding,
+                temperature=model.config.temperature,
+                length_penalty=model.config.length_penalty,
+                repetition_penalty=model.config.repetition_penalty,
+                top_k=model.config.top_k,
+                top_p=model.config.top_p,
+                enable_text_splitting=True
+            )
+        
+        return self._to_wav_bytes(out["wav"])
+
+    def stream_by_audio(self, text: str, speaker_wav_path: str, language: str = "en") -> Iterator[bytes]:
+        """Yield raw PCM16 chunks as the GPT decoder produces them"""
+        gpt_cond_latent, speaker_embedding = self._get_conditioning_latents(speaker_wav_path)
+        
+        model = self.tts.synthesizer.tts_model
+        with self._inference_context():
+            for chunk in model.inference_stream(
+                text,
+                language,
+                gpt_cond_latent,
+                speaker_embedding,
+                temperature=model.config.temperature,
+                length_penalty=model.config.length_penalty,
+                repetition_penalty=model.config.repetition_penalty,
+                top_k=model.config.top_k,
+                top_p=model.config.top_p,
+                enable_text_splitting=True
+            ):
+                yield to_pcm16_bytes(chunk)
 
 xtts_service = XTTSService()
@@ -7,7 +7,8 @@ class YourTTSService(CoquiTTSService):
     def get_service_name(self) -> str:
         return "YourTTS"
     
-    def get_supported_languages(self):
-        return ["en", "fr-fr", "pt-br"]
+    def load_models(self):
+        super().load_models()
+        self._languages = ["en", "fr-fr", "pt-br"]
 
 yourtts_service = YourTTSService()
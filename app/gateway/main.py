@@ -3,13 +3,17 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
-import json
+from watchfiles import awatch
+import orjson
 import uuid
+import base64
 import time
 import os
 import io
 import sys
+import struct
 import asyncio
+import weakref
 from pathlib import Path
 
 app = FastAPI(title="TTS Demo")
@@ -21,10 +25,19 @@ WORKER_INFO_FILES = {
     "coqui": "/tmp/coqui.info",
     "neutts": "/tmp/neutts.info"
 }
+# Engines served over a Unix socket; the rest use the file-based job queue
+WORKER_SOCKETS = {
+    "coqui": "/tmp/tts_coqui.sock"
+}
+# Worker processes serving each socket, one job can be in flight per process
+WORKER_PROCESSES = {
+    "coqui": int(os.getenv("COQUI_WORKER_PROCESSES", "1"))
+}
 
 @app.on_event("startup")
 async def startup_event():
     print("Starting TTS Gateway...")
+    app.state.marker_watcher = asyncio.create_task(_watch_done_markers())
     print(f"ENABLED_WORKERS: {os.getenv('ENABLED_WORKERS')}")
     print(f"Python path: {sys.path}")
     print(f"Current working directory: {os.getcwd()}")
@@ -49,8 +62,7 @@ async def startup_event():
                 for worker in ENABLED_WORKERS:
                     if worker in WORKER_INFO_FILES:
                         info_path = WORKER_INFO_FILES[worker]
-                        with open(info_path, 'r') as f:
-                            worker_capabilities[worker] = json.load(f)
+                        worker_capabilities[worker] = orjson.loads(Path(info_path).read_bytes())
                 
                 print("All workers initialized successfully!")
                 print(f"Available engines: {list(worker_capabilities.keys())}")
@@ -63,6 +75,10 @@ async def startup_event():
     
     print("Warning: Some workers may not be ready. Available engines:", list(worker_capabilities.keys()))
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.marker_watcher.cancel()
+
 app.mount("/static", StaticFiles(directory="gateway/static"), name="static")
 
 class TTSRequest(BaseModel):
@@ -72,6 +88,8 @@ class TTSRequest(BaseModel):
     submodel: Optional[str] = None
     language: str = "en"
     speaker: Optional[str] = None
+    # NeuTTS only: text is already espeak IPA, skip phonemization
+    pre_phonemized: bool = False
 
 class TTSResponse(BaseModel):
     audio_data: str
@@ -104,27 +122,60 @@ async def get_models():
 async def health_check():
     return {"ok": True}
 
-async def wait_for_job_completion(job_id: str, timeout: int = 600) -> tuple[bool, str]:
-    """Wait for job completion and return (success, message)"""
-    start_time = time.time()
+def _get_job_status(job_id: str) -> Optional[tuple[bool, str]]:
+    """Return (success, message) if the worker finished the job, None if still pending"""
+    ok_path = Path(f"/tmp/tts_done/{job_id}.ok")
+    err_path = Path(f"/tmp/tts_done/{job_id}.err")
     
-    while time.time() - start_time < timeout:
-        ok_path = Path(f"/tmp/tts_done/{job_id}.ok")
-        err_path = Path(f"/tmp/tts_done/{job_id}.err")
-        
-        if ok_path.exists():
-            return True, "Success"
-        elif err_path.exists():
-            try:
-                with open(err_path, 'r') as f:
-                    error_msg = f.read().strip()
-                return False, error_msg
-            except:
-                return False, "Unknown error"
-        
-        await asyncio.sleep(0.1)
+    if ok_path.exists():
+        return True, "Success"
+    elif err_path.exists():
+        try:
+            with open(err_path, 'r') as f:
+                error_msg = f.read().strip()
+            return False, error_msg
+        except:
+            return False, "Unknown error"
     
-    return False, "Timeout"
+    return None
+
+# File-queue jobs waiting for their /tmp/tts_done marker, resolved by the shared watcher
+job_waiters: Dict[str, asyncio.Future] = {}
+
+async def _watch_done_markers():
+    """App-lifetime watch on /tmp/tts_done that resolves the waiting requests"""
+    while True:
+        try:
+            async for changes in awatch("/tmp/tts_done", step=5):
+                for _, path in changes:
+                    job_id = Path(path).stem
+                    waiter = job_waiters.get(job_id)
+                    if waiter is None or waiter.done():
+                        continue
+                    status = _get_job_status(job_id)
+                    if status is not None:
+                        waiter.set_result(status)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Job marker watcher failed, restarting: {e}")
+            await asyncio.sleep(1)
+
+async def wait_for_job_completion(job_id: str, timeout: int = 600) -> tuple[bool, str]:
+    """Wait for job completion and return (success, message)"""
+    waiter = asyncio.get_running_loop().create_future()
+    job_waiters[job_id] = waiter
+    try:
+        # Registered before checking, so a marker written in between is seen by one or the other
+        status = _get_job_status(job_id)
+        if status is not None:
+            return status
+        
+        return await asyncio.wait_for(waiter, timeout)
+    except asyncio.TimeoutError:
+        return False, "Timeout"
+    finally:
+        job_waiters.pop(job_id, None)
 
 def cleanup_job_files(job_id: str):
     files_to_clean = [
@@ -141,8 +192,148 @@ def cleanup_job_files(job_id: str):
         except:
             pass
 
-@app.post("/tts", response_model=TTSResponse)
-async def synthesize_speech(request: TTSRequest):
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    (length,) = struct.unpack("!I", await reader.readexactly(4))
+    return await reader.readexactly(length)
+
+async def _read_job_result(reader: asyncio.StreamReader) -> tuple[bool, Any]:
+    status = orjson.loads(await _read_frame(reader))
+    if not status["ok"]:
+        return False, status.get("error", "Unknown error")
+    
+    return True, await _read_frame(reader)
+
+async def _submit_socket_job(engine: str, job_data: Dict[str, Any]) -> tuple[bool, Any]:
+    """Send one job over its own worker connection and return (success, audio bytes or error message)"""
+    # One job per worker process at a time, the rest wait here instead of queueing behind a busy process
+    async with worker_slots[engine]:
+        try:
+            reader, writer = await asyncio.open_unix_connection(WORKER_SOCKETS[engine])
+        except Exception as e:
+            return False, f"Worker connection failed: {e}"
+        
+        try:
+            payload = orjson.dumps(job_data)
+            writer.write(struct.pack("!I", len(payload)) + payload)
+            await writer.drain()
+            return await _read_job_result(reader)
+        except Exception as e:
+            return False, f"Worker connection failed: {e}"
+        finally:
+            writer.close()
+            await writer.wait_closed()
+
+worker_slots = {
+    engine: asyncio.Semaphore(WORKER_PROCESSES.get(engine, 1))
+    for engine in WORKER_SOCKETS
+}
+
+def _streaming_wav_header(sample_rate: int, channels: int = 1, sample_width: int = 2) -> bytes:
+    # Total length is unknown up front, players treat 0xFFFFFFFF sizes as "read until EOF"
+    block_align = channels * sample_width
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 0xFFFFFFFF, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, sample_width * 8,
+        b"data", 0xFFFFFFFF
+    )
+
+async def stream_job(engine: str, job_data: Dict[str, Any], timeout: int = 600) -> tuple[bool, Any]:
+    """Start a streaming job, return (True, WAV chunk iterator) or (False, error message)"""
+    # The stream occupies a worker process until it's closed, hold its slot for that long
+    slot = worker_slots[engine]
+    try:
+        await asyncio.wait_for(slot.acquire(), timeout)
+    except asyncio.TimeoutError:
+        return False, "Timeout"
+    
+    try:
+        reader, writer = await asyncio.open_unix_connection(WORKER_SOCKETS[engine])
+    except Exception as e:
+        slot.release()
+        return False, f"Worker connection failed: {e}"
+    except BaseException:
+        slot.release()
+        raise
+    
+    released = False
+    
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            slot.release()
+            writer.close()
+    
+    async def close():
+        release()
+        await writer.wait_closed()
+    
+    try:
+        payload = orjson.dumps({**job_data, "stream": True})
+        writer.write(struct.pack("!I", len(payload)) + payload)
+        await writer.drain()
+        
+        status = orjson.loads(await asyncio.wait_for(_read_frame(reader), timeout))
+    except asyncio.TimeoutError:
+        await close()
+        return False, "Timeout"
+    except Exception as e:
+        await close()
+        return False, f"Worker connection failed: {e}"
+    except BaseException:
+        await close()
+        raise
+    
+    if not status["ok"]:
+        await close()
+        return False, status.get("error", "Unknown error")
+    
+    async def chunks():
+        try:
+            yield _streaming_wav_header(status["sample_rate"])
+            while chunk := await _read_frame(reader):
+                yield chunk
+        finally:
+            await close()
+    
+    stream = chunks()
+    # A generator that's never iterated (client gone before the body starts) skips its finally
+    weakref.finalize(stream, release)
+    return True, stream
+
+async def _submit_file_job(engine: str, job_data: Dict[str, Any], timeout: int) -> tuple[bool, Any]:
+    """Queue a job file for the worker and return (success, audio bytes or error message)"""
+    job_id = job_data["id"]
+    job_path = f"/tmp/tts_queue/{engine}/job_{job_id}.json"
+    with open(job_path, 'wb') as f:
+        f.write(orjson.dumps(job_data))
+    
+    success, message = await wait_for_job_completion(job_id, timeout)
+    
+    if not success:
+        return False, message
+    
+    output_path = f"/tmp/tts_out/{job_id}.wav"
+    if not os.path.exists(output_path):
+        return False, "Output file not found"
+    
+    return True, await asyncio.to_thread(Path(output_path).read_bytes)
+
+async def run_job(engine: str, job_data: Dict[str, Any], timeout: int = 600) -> tuple[bool, Any]:
+    """Run a synthesis job on the engine's worker and return (success, audio bytes or error message)"""
+    try:
+        if engine in WORKER_SOCKETS:
+            return await asyncio.wait_for(_submit_socket_job(engine, job_data), timeout)
+        return await _submit_file_job(engine, job_data, timeout)
+    except asyncio.TimeoutError:
+        return False, "Timeout"
+    finally:
+        cleanup_job_files(job_data["id"])
+
+@app.post("/tts")
+async def synthesize_speech(request: TTSRequest, format: str = "wav"):
+    """Synthesize speech, returns WAV audio or base64 encoded TTSResponse with ?format=json"""
     try:
         if not request.text.strip():
             raise HTTPException(status_code=400, detail="Text cannot be empty")
@@ -165,36 +356,29 @@ async def synthesize_speech(request: TTSRequest):
             job_data["model"] = request.submodel or request.model
         elif request.engine == "neutts":
             job_data["model"] = "neuphonic/neutts-air"
+            if request.pre_phonemized:
+                job_data["pre_phonemized"] = True
         
         if request.speaker:
             job_data["speaker"] = request.speaker
         
-        job_path = f"/tmp/tts_queue/{request.engine}/job_{job_id}.json"
-        with open(job_path, 'w') as f:
-            json.dump(job_data, f)
-        
-        success, message = await wait_for_job_completion(job_id)
+        success, result = await run_job(request.engine, job_data)
         
         if not success:
-            cleanup_job_files(job_id)
-            raise HTTPException(status_code=500, detail=f"TTS synthesis failed: {message}")
-        
-        output_path = f"/tmp/tts_out/{job_id}.wav"
-        if not os.path.exists(output_path):
-            cleanup_job_files(job_id)
-            raise HTTPException(status_code=500, detail="Output file not found")
+            raise HTTPException(status_code=500, detail=f"TTS synthesis failed: {result}")
         
-        with open(output_path, 'rb') as f:
-            audio_bytes = f.read()
+        audio_bytes = result
         
-        cleanup_job_files(job_id)
+        if format == "json":
+            return TTSResponse(
+                audio_data=base64.b64encode(memoryview(audio_bytes)).decode("ascii"),
+                engine=request.engine
+            )
         
-        import base64
-        audio_data = base64.b64encode(audio_bytes).decode("utf-8")
-        
-        return TTSResponse(
-            audio_data=audio_data,
-            engine=request.engine
+        return StreamingResponse(
+            io.BytesIO(audio_bytes),
+            media_type="audio/wav",
+            headers={"Content-Disposition": f"attachment; filename=speech_{request.engine}.wav"}
         )
         
     except HTTPException:
@@ -209,6 +393,8 @@ async def synthesize_with_audio(
     engine: str = Form(...),
     model: str = Form(...), 
     submodel: str = Form(None),
+    stream: bool = Form(False),
+    pre_phonemized: bool = Form(False),
     file: UploadFile = File(...)
 ):
     try:
@@ -224,9 +410,8 @@ async def synthesize_with_audio(
         job_id = str(uuid.uuid4())
         
         ref_audio_path = f"/tmp/tts_in/{job_id}.wav"
-        with open(ref_audio_path, 'wb') as f:
-            content = await file.read()
-            f.write(content)
+        content = await file.read()
+        await asyncio.to_thread(Path(ref_audio_path).write_bytes, content)
         
         job_data = {
             "id": job_id,
@@ -239,26 +424,29 @@ async def synthesize_with_audio(
             job_data["model"] = submodel or model
         elif engine == "neutts":
             job_data["model"] = "neuphonic/neutts-air"
+            if pre_phonemized:
+                job_data["pre_phonemized"] = True
         
-        job_path = f"/tmp/tts_queue/{engine}/job_{job_id}.json"
-        with open(job_path, 'w') as f:
-            json.dump(job_data, f)
-        
-        success, message = await wait_for_job_completion(job_id)
+        if stream and engine in WORKER_SOCKETS:
+            try:
+                success, result = await stream_job(engine, job_data)
+            except BaseException:
+                cleanup_job_files(job_id)
+                raise
+            
+            if not success:
+                # Worker may never have seen the job, remove the uploaded reference here
+                cleanup_job_files(job_id)
+                raise HTTPException(status_code=500, detail=f"TTS synthesis failed: {result}")
+            
+            return StreamingResponse(result, media_type="audio/wav")
+        
+        success, result = await run_job(engine, job_data)
         
         if not success:
-            cleanup_job_files(job_id)
-            raise HTTPException(status_code=500, detail=f"TTS synthesis failed: {message}")
-        
-        output_path = f"/tmp/tts_out/{job_id}.wav"
-        if not os.path.exists(output_path):
-            cleanup_job_files(job_id)
-            raise HTTPException(status_code=500, detail="Output file not found")
-        
-        with open(output_path, 'rb') as f:
-            audio_bytes = f.read()
+            raise HTTPException(status_code=500, detail=f"TTS synthesis failed: {result}")
         
-        cleanup_job_files(job_id)
+        audio_bytes = result
         
         return StreamingResponse(
             io.BytesIO(audio_bytes), 
@@ -14,4 +14,13 @@ from gateway.main import app
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=1,
+        limit_concurrency=64,
+        timeout_keep_alive=30
+    )
@@ -2,7 +2,7 @@ import os
 import io
 import uuid
 import soundfile as sf
-from typing import List
+from typing import List, Optional
 
 # NeuTTS Air imports
 try:
@@ -17,14 +17,14 @@ class NeuTTSService:
         self.speakers: List[str] = []
 
     def get_model_name(self) -> str:
-        # Use GGUF quantized model by default for better CPU performance
-        # neuphonic/neutts-air better for GPU
-        return "neuphonic/neutts-air-q8-gguf"
+        # Use 4-bit GGUF quantized model by default for better CPU performance
+        # neuphonic/neutts-air-q8-gguf trades speed for quality, neuphonic/neutts-air better for GPU
+        return "neuphonic/neutts-air-q4-gguf"
     
     def get_service_name(self) -> str:
         return "NeuTTS"
 
-    def load_models(self):
+    def load_models(self, n_threads: Optional[int] = None):
         if NeuTTSAir is None:
             raise ImportError("NeuTTS Air module not found")
         
@@ -34,7 +34,8 @@ class NeuTTSService:
                 backbone_repo=self.get_model_name(),
                 backbone_device="cpu",
                 codec_repo="neuphonic/neucodec",
-                codec_device="cpu"
+                codec_device="cpu",
+                n_threads=n_threads
             )
             print(f"{self.get_service_name()} ready.")
         except Exception as e:
@@ -50,10 +51,13 @@ class NeuTTSService:
     def synthesize_by_speaker(self, text: str, speaker_id: str, language: str = "en") -> bytes:
         raise NotImplementedError("NeuTTS Air requires custom audio reference")
 
-    def synthesize_by_audio(self, text: str, speaker_wav_path: str, language: str = "en") -> bytes:
+    def phonemize_batch(self, texts: List[str]) -> List[str]:
+        return self.tts.phonemize(texts)
+
+    def synthesize_by_audio(self, text: str, speaker_wav_path: str, language: str = "en", phones: Optional[str] = None) -> bytes:
         try:
             ref_codes = self.tts.encode_reference(speaker_wav_path)
-            wav = self.tts.infer(text, ref_codes)
+            wav = self.tts.infer(text, ref_codes, phones)
             
             buf = io.BytesIO()
             sf.write(buf, wav, 24000, format="WAV", subtype="PCM_16")
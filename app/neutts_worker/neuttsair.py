@@ -4,34 +4,107 @@ Code copied from https://github.com/neuphonic/neutts-air/blob/main/neuttsair/neu
 """
 
 import torch
-import torchaudio
 import numpy as np
-from typing import Union, List, Optional
+import soundfile as sf
+import soxr
+import xxhash
+from collections import OrderedDict
+from typing import Union, List, Optional, Iterator
 import os
 from pydub import AudioSegment
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
 from pathlib import Path
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from transformers import AutoModelForCausalLM, AutoTokenizer, StaticCache
+from transformers.generation.streamers import BaseStreamer
 from phonemizer.backend import EspeakBackend
 from neucodec import NeuCodec, DistillNeuCodec
 import re
 from llama_cpp import Llama
 
+try:
+    # Linear-time DFA matching for the long speech token strings
+    import re2 as _regex
+except ImportError:
+    _regex = re
+
+_SPEECH_TOKEN_RE = _regex.compile(r"<\|speech_(\d+)\|>")
+_GGML_SCAFFOLD_PREFIX = "user: Convert the text to speech:<|TEXT_PROMPT_START|>"
+
+class _SpeechTokenStreamer(BaseStreamer):
+    """Hands generated tokens to the consumer as soon as they're sampled.
+    TextIteratorStreamer waits for a space before flushing, and speech tokens never contain one."""
+    
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.queue: Queue = Queue()
+        self._skip_prompt = True
+    
+    def put(self, value):
+        if self._skip_prompt:
+            # generate() pushes the prompt first
+            self._skip_prompt = False
+            return
+        self.queue.put(self.tokenizer.decode(value.reshape(-1).tolist(), add_special_tokens=False))
+    
+    def end(self):
+        self.queue.put(None)
+    
+    def __iter__(self):
+        while True:
+            piece = self.queue.get()
+            if piece is None:
+                return
+            yield piece
+
+def cpu_has_native_bf16() -> bool:
+    """True if /proc/cpuinfo lists bf16 instructions, elsewhere bf16 is emulated and slower than fp32"""
+    try:
+        cpuinfo = Path("/proc/cpuinfo").read_text()
+    except OSError:
+        return False
+    for line in cpuinfo.splitlines():
+        # x86 lists avx512_bf16/amx_bf16 under "flags", ARM (Neoverse V1/V2, Graviton3+) bf16 under "Features"
+        if line.startswith(("flags", "Features")):
+            flags = set(line.split(":", 1)[1].split())
+            return bool(flags & {"avx512_bf16", "amx_bf16", "bf16"})
+    return False
+
 class NeuTTSAir:
     MAX_CONTEXT = 2048
+    REF_SAMPLE_RATE = 24000
+    REF_MAX_SECONDS = 10
+    CODEC_INPUT_SAMPLE_RATE = 16000
+    REF_CODES_CACHE_SIZE = 32
+    PHONES_CACHE_SIZE = 2048
+    SAMPLES_PER_TOKEN = 480  # NeuCodec runs at 50 tokens/s for 24 kHz output
+    STREAM_CHUNK_TOKENS = 200
+    SPEECH_TOKENS_PER_PHONE_TOKEN = 12  # rough average, only used to size the generation budget
+    STREAM_LOOKBACK_TOKENS = 25
+    STREAM_LOOKAHEAD_TOKENS = 25
     
     def __init__(
         self,
         backbone_repo: str = "neuphonic/neutts-air",
         backbone_device: str = "cpu",
         codec_repo: str = "neuphonic/neucodec", 
-        codec_device: str = "cpu"
+        codec_device: str = "cpu",
+        prefer_gguf_on_cpu: bool = True,
+        n_threads: Optional[int] = None
     ):
         self.backbone_repo = backbone_repo
         self.backbone_device = backbone_device
         self.codec_repo = codec_repo
         self.codec_device = codec_device
+        self.prefer_gguf_on_cpu = prefer_gguf_on_cpu
+        self.n_threads = n_threads or os.cpu_count() or 1
         
         self._is_quantized_model = False
+        self._ref_codes_cache: OrderedDict = OrderedDict()
+        self._phones_cache: OrderedDict = OrderedDict()
+        self._prompt_buf: Optional[torch.Tensor] = None
+        self._kv_cache: Optional[StaticCache] = None
         self.backbone_model = None
         self.backbone_tokenizer = None
         
@@ -44,6 +117,16 @@ class NeuTTSAir:
                 language="en-us", preserve_punctuation=True, with_stress=True
             )
             
+            if (
+                self.prefer_gguf_on_cpu
+                and not self.backbone_device.startswith("cuda")
+                and not self.backbone_repo.lower().endswith("gguf")
+            ):
+                # FP32 transformer on CPU is far slower and heavier than the 4-bit llama.cpp build
+                gguf_repo = f"{self.backbone_repo}-q4-gguf"
+                print(f"CPU backbone requested, using quantized sibling {gguf_repo} instead of {self.backbone_repo}")
+                self.backbone_repo = gguf_repo
+            
             if self.backbone_repo.lower().endswith("gguf"):
                 print(f"Loading GGUF model: {self.backbone_repo} (device: CPU)")
                 self.backbone_model = Llama.from_pretrained(
@@ -52,23 +135,51 @@ class NeuTTSAir:
                     verbose=False,
                     n_gpu_layers=0,  # CPU only
                     n_ctx=self.MAX_CONTEXT,
+                    n_threads=self.n_threads,
+                    n_batch=512,
                     mlock=True,
-                    flash_attn=False,
+                    flash_attn=True,
                 )
                 self._is_quantized_model = True
+                # BOS and the fixed prompt start, tokenized once
+                self._ggml_scaffold_tokens = self.backbone_model.tokenize(
+                    _GGML_SCAFFOLD_PREFIX.encode("utf-8"), special=True
+                )
+                self._warmup_ggml()
                 print("GGUF model loaded successfully")
             else:
                 print(f"Loading transformer model: {self.backbone_repo} (device: {self.backbone_device})")
                 self.backbone_tokenizer = AutoTokenizer.from_pretrained(self.backbone_repo)
+                self._build_speech_token_ids()
+                self._build_chat_scaffold()
+                self.backbone_dtype = self._select_backbone_dtype()
                 self.backbone_model = AutoModelForCausalLM.from_pretrained(
                     self.backbone_repo,
-                    torch_dtype=torch.float32
+                    torch_dtype=self.backbone_dtype
                 ).to(torch.device(self.backbone_device))
+                self.backbone_model.eval()
+                # One MAX_CONTEXT-sized KV cache for every request, so prompt/budget changes never
+                # reallocate it or invalidate the compiled graphs
+                self._kv_cache = StaticCache(
+                    config=self.backbone_model.config,
+                    max_batch_size=1,
+                    max_cache_len=self.MAX_CONTEXT
+                )
+                # Reused host buffer for prompt ids, pinned so the upload to GPU can be async
+                self._prompt_buf = torch.empty(
+                    (1, self.MAX_CONTEXT),
+                    dtype=torch.long,
+                    pin_memory=self.backbone_device.startswith("cuda")
+                )
+                self._compile_backbone()
                 print("Transformer model loaded successfully")
             
             print(f"Loading NeuCodec: {self.codec_repo} (device: {self.codec_device})")
             self.codec_model = NeuCodec.from_pretrained(self.codec_repo)
             self.codec_model.eval().to(self.codec_device)
+            # Weights stay fp32, autocast runs the heavy convs/matmuls in half precision
+            self.codec_dtype = self._select_codec_dtype()
+            print(f"NeuCodec compute dtype: {self.codec_dtype}")
             print("NeuCodec loaded successfully")
             
             print("NeuTTS Air models loaded successfully!")
@@ -77,52 +188,154 @@ class NeuTTSAir:
             print(f"Error loading NeuTTS Air models: {e}")
             raise
     
-    def _convert_audio_to_wav(self, input_path: str) -> str:
+    def _select_backbone_dtype(self) -> torch.dtype:
+        # bf16 halves the weight traffic of the memory-bound decode on CPUs that support it natively
+        if self.backbone_device == "cpu" and cpu_has_native_bf16():
+            print("CPU supports bf16, loading transformer backbone in bfloat16")
+            return torch.bfloat16
+        return torch.float32
+    
+    def _select_codec_dtype(self) -> torch.dtype:
+        if self.codec_device.startswith("cuda"):
+            return torch.float16
+        if cpu_has_native_bf16():
+            return torch.bfloat16
+        return torch.float32
+    
+    def _codec_autocast(self):
+        return torch.autocast(
+            device_type=torch.device(self.codec_device).type,
+            dtype=self.codec_dtype,
+            enabled=self.codec_dtype != torch.float32
+        )
+    
+    def _build_chat_scaffold(self):
+        # Fixed parts of the prompt, only the phones and reference codes change per request
+        tokenizer = self.backbone_tokenizer
+        speech_replace = tokenizer.convert_tokens_to_ids("<|SPEECH_REPLACE|>")
+        text_replace = tokenizer.convert_tokens_to_ids("<|TEXT_REPLACE|>")
+        self._speech_gen_start = tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_START|>")
+        self._speech_gen_end = tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
+        self._text_prompt_start = tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_START|>")
+        self._text_prompt_end = tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_END|>")
+        
+        chat = """user: Convert the text to speech:<|TEXT_REPLACE|>\nassistant:<|SPEECH_REPLACE|>"""
+        self._scaffold_ids = tokenizer.encode(chat)
+        text_replace_idx = self._scaffold_ids.index(text_replace)
+        speech_replace_idx = self._scaffold_ids.index(speech_replace)
+        self._scaffold_pre = self._scaffold_ids[:text_replace_idx]
+        self._scaffold_mid = self._scaffold_ids[text_replace_idx + 1:speech_replace_idx]
+    
+    def _build_speech_token_ids(self):
+        # Lookup table codec code -> token id, so reference codes don't go through BPE encoding
+        codebook_size = 1 + max(
+            int(m.group(1))
+            for token in self.backbone_tokenizer.get_vocab()
+            if (m := _SPEECH_TOKEN_RE.fullmatch(token))
+        )
+        self._speech_token_ids = np.fromiter(
+            (self.backbone_tokenizer.convert_tokens_to_ids(f"<|speech_{i}|>") for i in range(codebook_size)),
+            dtype=np.int64,
+            count=codebook_size
+        )
+    
+    def _warmup_ggml(self):
+        # One-token completion on an empty-text prompt, so the first request doesn't pay for the first
+        # graph evaluation and compute buffer allocation. It also leaves the fixed scaffold in the KV
+        # cache, which llama.cpp reuses as the longest prefix shared with the next prompt
+        suffix = "<|TEXT_PROMPT_END|>\nassistant:<|SPEECH_GENERATION_START|>"
+        tokens = self._ggml_scaffold_tokens + self.backbone_model.tokenize(
+            suffix.encode("utf-8"), add_bos=False, special=True
+        )
+        self.backbone_model(tokens, max_tokens=1)
+        print(f"GGUF backbone warmed up ({len(tokens)} prompt tokens)")
+    
+    def _generate(self, prompt_tensor: torch.Tensor, **kwargs):
+        # Must run under inference_mode: the cache tensors are created there on first use
+        self._kv_cache.reset()
+        return self.backbone_model.generate(prompt_tensor, past_key_values=self._kv_cache, **kwargs)
+    
+    def _compile_backbone(self):
+        eager_forward = self.backbone_model.forward
         try:
-            output_path = input_path.replace('.wav', '_converted.wav')
-            
-            audio = AudioSegment.from_file(input_path)
-            
-            # IMPORTANT: Limit reference audio to 10 seconds to avoid token limit issues
-            max_duration_ms = 10 * 1000  # 10 seconds
-            if len(audio) > max_duration_ms:
-                print(f"Warning: Reference audio too long ({len(audio)/1000:.1f}s), truncating to 10s")
-                audio = audio[:max_duration_ms]
-            
-            audio = audio.set_channels(1)  # Mono
-            audio = audio.set_frame_rate(24000)  # 24kHz
-            
-            audio.export(output_path, format="wav")
-            
-            print(f"Audio converted: {input_path} -> {output_path} (duration: {len(audio)/1000:.1f}s)")
-            return output_path
+            print("Compiling transformer backbone with torch.compile...")
+            # Prompt lengths differ per request, leave dynamic shape detection to dynamo
+            self.backbone_model.forward = torch.compile(eager_forward, mode="reduce-overhead")
             
+            # Two short generations: the first compiles prefill and decode graphs, the second replays them
+            dummy_prompt = torch.tensor(
+                [self.backbone_tokenizer.encode("user: warmup")], device=self.backbone_model.device
+            )
+            with torch.inference_mode():
+                for _ in range(2):
+                    self._generate(dummy_prompt, max_new_tokens=2)
+            print("Transformer backbone compiled")
         except Exception as e:
-            print(f"Error converting audio: {e}")
-            raise
+            print(f"torch.compile failed, falling back to eager mode: {e}")
+            self.backbone_model.forward = eager_forward
     
-    def encode_reference(self, audio_path: str) -> torch.Tensor:
+    def _load_reference_audio(self, input_path: str, target_sr: int = REF_SAMPLE_RATE) -> np.ndarray:
+        """Load reference audio as mono float32 at target_sr (24 kHz by default)"""
+        try:
+            data, sr = sf.read(input_path, dtype="float32", always_2d=True)
+        except Exception:
+            # soundfile can't open browser recordings (webm/m4a), decode via ffmpeg
+            audio = AudioSegment.from_file(input_path)
+            data = np.array(audio.get_array_of_samples(), dtype=np.float32).reshape(-1, audio.channels)
+            data /= float(1 << (8 * audio.sample_width - 1))
+            sr = audio.frame_rate
+        
+        # IMPORTANT: Limit reference audio to 10 seconds to avoid token limit issues
+        max_samples = self.REF_MAX_SECONDS * sr
+        if len(data) > max_samples:
+            print(f"Warning: Reference audio too long ({len(data)/sr:.1f}s), truncating to {self.REF_MAX_SECONDS}s")
+            data = data[:max_samples]
+        
+        data = data.mean(axis=1)
+        if sr != target_sr:
+            data = soxr.resample(data, sr, target_sr, quality="HQ")
+        
+        print(f"Reference audio loaded: {input_path} (duration: {len(data)/target_sr:.1f}s)")
+        return data
+    
+    def encode_reference(self, audio: Union[str, np.ndarray]) -> torch.Tensor:
+        """Encode a reference file path, or mono 24 kHz float32 samples, into codec codes"""
+        if isinstance(audio, str):
+            with open(audio, "rb") as f:
+                key = xxhash.xxh3_64_hexdigest(f.read())
+        else:
+            key = xxhash.xxh3_64_hexdigest(np.ascontiguousarray(audio, dtype=np.float32).tobytes())
+        
+        ref_codes = self._ref_codes_cache.get(key)
+        if ref_codes is not None:
+            self._ref_codes_cache.move_to_end(key)
+            print("Using cached reference codes")
+            return ref_codes
+        
+        ref_codes = self._encode_reference(audio).cpu()
+        self._ref_codes_cache[key] = ref_codes
+        if len(self._ref_codes_cache) > self.REF_CODES_CACHE_SIZE:
+            self._ref_codes_cache.popitem(last=False)
+        return ref_codes
+    
+    def _encode_reference(self, audio: Union[str, np.ndarray]) -> torch.Tensor:
         try:
             print("Encoding reference audio...")
             
-            try:
-                converted_path = self._convert_audio_to_wav(audio_path)
-                audio_path = converted_path
-            except Exception as e:
-                print(f"Warning: Could not convert audio: {e}")
-                print("Trying to load original file...")
-            
-            waveform, sample_rate = torchaudio.load(audio_path)
-            
-            if sample_rate != 16000:
-                resampler = torchaudio.transforms.Resample(sample_rate, 16000)
-                waveform = resampler(waveform)
-            
-            if waveform.shape[0] > 1:
-                waveform = waveform.mean(dim=0, keepdim=True)
+            if isinstance(audio, str):
+                # Straight from the source rate to the codec's input rate, one resampling pass
+                audio = self._load_reference_audio(audio, self.CODEC_INPUT_SAMPLE_RATE)
+            else:
+                audio = soxr.resample(
+                    np.ascontiguousarray(audio, dtype=np.float32),
+                    self.REF_SAMPLE_RATE,
+                    self.CODEC_INPUT_SAMPLE_RATE,
+                    quality="HQ"
+                )
             
-            wav_tensor = waveform.unsqueeze(0)
+            wav_tensor = torch.from_numpy(np.ascontiguousarray(audio, dtype=np.float32))[None, None, :]
             
+            # Encoder stays in fp32, precision changes the quantized codes and they're cached anyway
             with torch.no_grad():
                 ref_codes = self.codec_model.encode_code(audio_or_path=wav_tensor).squeeze(0).squeeze(0)
                 print("Reference audio encoded")
@@ -133,117 +346,191 @@ class NeuTTSAir:
             raise
     
     def _to_phones(self, text: str) -> str:
-        phones = self.phonemizer.phonemize([text])
-        phones = phones[0].split()
-        phones = " ".join(phones)
-        return phones
+        return self._to_phones_batch([text])[0]
     
-    def _apply_chat_template(self, ref_codes: list, input_text: str) -> list:
-        input_text_phones = self._to_phones(input_text)
-        
-        speech_replace = self.backbone_tokenizer.convert_tokens_to_ids("<|SPEECH_REPLACE|>")
-        speech_gen_start = self.backbone_tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_START|>")
-        text_replace = self.backbone_tokenizer.convert_tokens_to_ids("<|TEXT_REPLACE|>")
-        text_prompt_start = self.backbone_tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_START|>")
-        text_prompt_end = self.backbone_tokenizer.convert_tokens_to_ids("<|TEXT_PROMPT_END|>")
+    def _to_phones_batch(self, texts: List[str]) -> List[str]:
+        # Repeated phrases skip espeak, the rest go through a single call
+        misses = list(dict.fromkeys(t for t in texts if t not in self._phones_cache))
+        if misses:
+            # njobs>1 splits the batch across cores
+            njobs = max(1, min(len(misses), self.n_threads // 2))
+            phones = self.phonemizer.phonemize(misses, njobs=njobs)
+            for text, p in zip(misses, phones):
+                self._phones_cache[text] = " ".join(p.split())
         
+        result = []
+        for text in texts:
+            self._phones_cache.move_to_end(text)
+            result.append(self._phones_cache[text])
+        while len(self._phones_cache) > self.PHONES_CACHE_SIZE:
+            self._phones_cache.popitem(last=False)
+        return result
+    
+    def phonemize(self, texts: List[str]) -> List[str]:
+        return self._to_phones_batch(texts)
+    
+    def _speech_token_budget(self, n_phone_tokens: int, prompt_len: int) -> tuple[int, int]:
+        """(min_new_tokens, max_new_tokens) sized to the text instead of the whole context window"""
+        est = n_phone_tokens * self.SPEECH_TOKENS_PER_PHONE_TOKEN
+        max_new = max(1, min(est + 128, self.MAX_CONTEXT - prompt_len))
+        min_new = min(max(50, est - 128), max_new)
+        return min_new, max_new
+    
+    def _apply_chat_template(self, ref_codes: list, input_text_phones: str) -> tuple[list, int]:
         input_ids = self.backbone_tokenizer.encode(input_text_phones, add_special_tokens=False)
+        codes = self._speech_token_ids[np.asarray(ref_codes)].tolist()
         
-        chat = """user: Convert the text to speech:<|TEXT_REPLACE|>\nassistant:<|SPEECH_REPLACE|>"""
-        ids = self.backbone_tokenizer.encode(chat)
-        
-        text_replace_idx = ids.index(text_replace)
         ids = (
-            ids[:text_replace_idx]
-            + [text_prompt_start]
+            self._scaffold_pre
+            + [self._text_prompt_start]
             + input_ids
-            + [text_prompt_end]
-            + ids[text_replace_idx + 1:]
+            + [self._text_prompt_end]
+            + self._scaffold_mid
+            + [self._speech_gen_start]
+            + codes
         )
         
-        speech_replace_idx = ids.index(speech_replace)
-        codes_str = "".join([f"<|speech_{i}|>" for i in ref_codes])
-        codes = self.backbone_tokenizer.encode(codes_str, add_special_tokens=False)
-        ids = ids[:speech_replace_idx] + [speech_gen_start] + list(codes)
-        
         if len(ids) > self.MAX_CONTEXT - 512:
             print(f"Warning: Prompt too long ({len(ids)} tokens, max safe is {self.MAX_CONTEXT - 512})")
             print(f"This should not happen with 10s reference audio. Consider shortening input text.")
         
-        return ids
+        return ids, len(input_ids)
     
-    def _infer_torch(self, prompt_ids: list) -> str:
-        prompt_tensor = torch.tensor(prompt_ids).unsqueeze(0).to(self.backbone_model.device)
-        speech_end_id = self.backbone_tokenizer.convert_tokens_to_ids("<|SPEECH_GENERATION_END|>")
+    def _infer_torch(self, prompt_ids: list, n_phone_tokens: int) -> Iterator[str]:
+        n = len(prompt_ids)
+        min_new_tokens, max_new_tokens = self._speech_token_budget(n_phone_tokens, n)
+        self._prompt_buf[0, :n] = torch.as_tensor(prompt_ids, dtype=torch.long)
+        prompt_tensor = self._prompt_buf[:, :n].to(self.backbone_model.device, non_blocking=True)
+        streamer = _SpeechTokenStreamer(self.backbone_tokenizer)
+        generate_error = []
         
-        with torch.no_grad():
-            output_tokens = self.backbone_model.generate(
-                prompt_tensor,
-                max_length=self.MAX_CONTEXT,
-                eos_token_id=speech_end_id,
-                do_sample=True,
-                temperature=1.0,
-                top_k=50,
-                use_cache=True,
-                min_new_tokens=50,
-            )
+        def generate():
+            try:
+                with torch.inference_mode(), torch.autocast(
+                    device_type="cpu",
+                    dtype=torch.bfloat16,
+                    enabled=self.backbone_dtype == torch.bfloat16
+                ):
+                    self._generate(
+                        prompt_tensor,
+                        max_new_tokens=max_new_tokens,
+                        eos_token_id=self._speech_gen_end,
+                        do_sample=True,
+                        temperature=1.0,
+                        top_k=50,
+                        use_cache=True,
+                        min_new_tokens=min_new_tokens,
+                        streamer=streamer,
+                    )
+            except Exception as e:
+                generate_error.append(e)
+                streamer.end()
         
-        input_length = prompt_tensor.shape[-1]
-        output_str = self.backbone_tokenizer.decode(
-            output_tokens[0, input_length:].cpu().numpy().tolist(), 
-            add_special_tokens=False
-        )
-        return output_str
-    
-    def _infer_ggml(self, ref_codes: list, input_text: str) -> str:
-        input_text_phones = self._to_phones(input_text)
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        yield from streamer
+        thread.join()
         
+        if generate_error:
+            raise generate_error[0]
+    
+    def _infer_ggml(self, ref_codes: list, input_text_phones: str) -> Iterator[str]:
         codes_str = "".join([f"<|speech_{idx}|>" for idx in ref_codes])
-        prompt = (
-            f"user: Convert the text to speech:<|TEXT_PROMPT_START|>{input_text_phones}"
-            f"<|TEXT_PROMPT_END|>\nassistant:<|SPEECH_GENERATION_START|>{codes_str}"
-        )
+        suffix = f"<|TEXT_PROMPT_END|>\nassistant:<|SPEECH_GENERATION_START|>{codes_str}"
+        # The phones sit between two special tokens, so tokenizing the pieces separately gives the same
+        # ids as the full prompt and yields the phone count for the budget without a second pass
+        phone_tokens = self.backbone_model.tokenize(input_text_phones.encode("utf-8"), add_bos=False, special=True)
+        suffix_tokens = self.backbone_model.tokenize(suffix.encode("utf-8"), add_bos=False, special=True)
+        prompt_tokens = self._ggml_scaffold_tokens + phone_tokens + suffix_tokens
+        _, max_tokens = self._speech_token_budget(len(phone_tokens), len(prompt_tokens))
         
-        output = self.backbone_model(
-            prompt,
-            max_tokens=self.MAX_CONTEXT,
+        # Passing tokens rather than the string saves create_completion from tokenizing it again
+        for chunk in self.backbone_model(
+            prompt_tokens,
+            max_tokens=max_tokens,
             temperature=1.0,
             top_k=50,
             stop=["<|SPEECH_GENERATION_END|>"],
-        )
-        output_str = output["choices"][0]["text"]
-        return output_str
+            stream=True,
+        ):
+            yield chunk["choices"][0]["text"]
     
-    def _decode(self, codes: str):
-        speech_ids = [int(num) for num in re.findall(r"<\|speech_(\d+)\|>", codes)]
+    def _decode(self, speech_ids: np.ndarray) -> torch.Tensor:
+        """Decode codes to a float32 waveform tensor, left on the codec device"""
+        with torch.no_grad():
+            # from_numpy shares the buffer, no extra copy on CPU
+            codes_tensor = torch.from_numpy(speech_ids)[None, None, :].to(
+                self.codec_model.device, non_blocking=True
+            )
+            with self._codec_autocast():
+                recon = self.codec_model.decode_code(codes_tensor)
         
-        if len(speech_ids) > 0:
-            with torch.no_grad():
-                codes_tensor = torch.tensor(speech_ids, dtype=torch.long)[None, None, :].to(
-                    self.codec_model.device
-                )
-                recon = self.codec_model.decode_code(codes_tensor).cpu().numpy()
+        return recon[0, 0, :].float()
+    
+    def _decode_chunk(self, speech_ids: np.ndarray, trim_left: int, trim_right: int) -> torch.Tensor:
+        # Lookback/lookahead tokens only give the codec context on both sides of the chunk,
+        # their samples come from the neighbouring chunks' full windows
+        wav = self._decode(speech_ids)
+        return wav[trim_left * self.SAMPLES_PER_TOKEN:len(wav) - trim_right * self.SAMPLES_PER_TOKEN]
+    
+    def _stream_decode(self, output_pieces: Iterator[str]) -> np.ndarray:
+        """Decode speech tokens in chunks while the backbone is still generating"""
+        codes: List[int] = []
+        tail = ""
+        emitted = 0
+        futures = []
+        
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            def submit(end: int, lookahead: int):
+                start = max(0, emitted - self.STREAM_LOOKBACK_TOKENS)
+                speech_ids = np.asarray(codes[start:end + lookahead], dtype=np.int64)
+                futures.append(executor.submit(self._decode_chunk, speech_ids, emitted - start, lookahead))
             
-            return recon[0, 0, :]
-        else:
-            raise ValueError("No valid speech tokens found in the output.")
+            for piece in output_pieces:
+                text = tail + piece
+                # A speech token can be split across pieces, hold back an unterminated "<|speech_..."
+                cut = text.rfind("<")
+                if cut != -1 and text.find(">", cut) == -1:
+                    text, tail = text[:cut], text[cut:]
+                else:
+                    tail = ""
+                codes.extend(map(int, _SPEECH_TOKEN_RE.findall(text)))
+                
+                # Chunk is only decoded once its lookahead tokens have been generated too
+                if len(codes) - emitted >= self.STREAM_CHUNK_TOKENS + self.STREAM_LOOKAHEAD_TOKENS:
+                    end = len(codes) - self.STREAM_LOOKAHEAD_TOKENS
+                    submit(end, self.STREAM_LOOKAHEAD_TOKENS)
+                    emitted = end
+            
+            codes.extend(map(int, _SPEECH_TOKEN_RE.findall(tail)))
+            if not codes:
+                raise ValueError("No valid speech tokens found in the output.")
+            if len(codes) > emitted:
+                submit(len(codes), 0)
+            
+            # Single device-to-host copy for the whole utterance, a no-op view on CPU
+            return torch.cat([f.result() for f in futures]).cpu().numpy()
     
     def infer(
         self, 
         text: str, 
-        ref_codes: list
+        ref_codes: list,
+        phones: Optional[str] = None
     ) -> np.ndarray:
         try:
             print("Generating TTS with reference audio...")
             
+            if phones is None:
+                phones = self._to_phones(text)
+            
             if self._is_quantized_model:
-                output_str = self._infer_ggml(ref_codes, text)
+                output_pieces = self._infer_ggml(ref_codes, phones)
             else:
-                prompt_ids = self._apply_chat_template(ref_codes, text)
-                output_str = self._infer_torch(prompt_ids)
+                prompt_ids, n_phone_tokens = self._apply_chat_template(ref_codes, phones)
+                output_pieces = self._infer_torch(prompt_ids, n_phone_tokens)
             
-            print("Encoding to WAV...")
-            wav = self._decode(output_str)
+            # Codec decoding runs alongside generation instead of after it
+            wav = self._stream_decode(output_pieces)
             
             print("Done")
             return wav
@@ -1,21 +1,31 @@
 #!/usr/bin/env python3
 
-import json
+import orjson
 import time
 import os
 import sys
+import queue
+import signal
+import multiprocessing as mp
+import torch
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any
+from inotify_simple import INotify, flags
+from typing import Dict, Any, List, Optional
 
 sys.path.append('/app')
 
 from neutts_worker.neutts_service import neutts_service
 
+# Max queued jobs whose texts are phonemized in a single espeak call
+JOB_BATCH_SIZE = 8
+
+def load_models(n_threads: Optional[int] = None):
+    print("Loading NeuTTS Air model...")
+    neutts_service.load_models(n_threads)
+
 def write_worker_info():
     try:
-        print("Loading NeuTTS Air model...")
-        neutts_service.load_models()
-        
         languages = neutts_service.get_supported_languages()
         speakers = neutts_service.get_available_speakers()
         
@@ -33,8 +43,7 @@ def write_worker_info():
             }
         }
         
-        with open("/tmp/neutts.info", 'w') as f:
-            json.dump(info, f, indent=2)
+        Path("/tmp/neutts.info").write_bytes(orjson.dumps(info, option=orjson.OPT_INDENT_2))
         
         print(f"NeuTTS worker ready. Languages: {languages}")
         print("NeuTTS requires custom reference audio")
@@ -45,7 +54,14 @@ def write_worker_info():
         traceback.print_exc()
         raise
 
-def process_job(job_data: Dict[str, Any]) -> tuple[bool, str]:
+def write_atomic(path: str, data: bytes):
+    # Gateway only checks the final name, so it never sees a half-written file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def process_job(job_data: Dict[str, Any], phones: Optional[str] = None) -> tuple[bool, str]:
     try:
         job_id = job_data["id"]
         text = job_data["text"]
@@ -61,14 +77,14 @@ def process_job(job_data: Dict[str, Any]) -> tuple[bool, str]:
         if not os.path.exists(ref_wav_path):
             return False, f"Reference audio file not found: {ref_wav_path}"
         
-        audio_bytes = neutts_service.synthesize_by_audio(text, ref_wav_path, language)
+        audio_bytes = neutts_service.synthesize_by_audio(text, ref_wav_path, language, phones)
         
         output_path = f"/tmp/tts_out/{job_id}.wav"
         with open(output_path, 'wb') as f:
             f.write(audio_bytes)
         
-        with open(f"/tmp/tts_done/{job_id}.ok", 'w') as f:
-            f.write("Success")
+        # Gateway only checks that the marker exists, an empty file is enough
+        os.close(os.open(f"/tmp/tts_done/{job_id}.ok", os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
         
         print(f"Job {job_id} completed successfully")
         return True, "Success"
@@ -78,57 +94,214 @@ def process_job(job_data: Dict[str, Any]) -> tuple[bool, str]:
         print(f"Job {job_data.get('id', 'unknown')} failed: {error_msg}")
         
         job_id = job_data.get("id", "unknown")
-        with open(f"/tmp/tts_done/{job_id}.err", 'w') as f:
-            f.write(error_msg)
+        write_atomic(f"/tmp/tts_done/{job_id}.err", error_msg.encode())
         
         return False, error_msg
 
+def load_job_batch(job_files: List[Path]) -> List[tuple[Path, Dict[str, Any]]]:
+    batch = []
+    for job_file in job_files:
+        try:
+            batch.append((job_file, orjson.loads(job_file.read_bytes())))
+        except Exception as e:
+            print(f"Error reading job file {job_file}: {e}")
+            try:
+                job_file.unlink()
+            except:
+                pass
+    return batch
+
+def phonemize_batch(batch: List[tuple[Path, Dict[str, Any]]]) -> List[Optional[str]]:
+    # Single espeak call for all pending texts, a failure here just falls back to per-job phonemization
+    phones_list: List[Optional[str]] = [None] * len(batch)
+    to_phonemize = []
+    for i, (_, job_data) in enumerate(batch):
+        text = job_data.get("text", "")
+        if job_data.get("pre_phonemized"):
+            # Client already sent IPA, use it as is
+            phones_list[i] = " ".join(text.split())
+        else:
+            to_phonemize.append(i)
+    
+    if not to_phonemize:
+        return phones_list
+    try:
+        phones = neutts_service.phonemize_batch([batch[i][1].get("text", "") for i in to_phonemize])
+        for i, p in zip(to_phonemize, phones):
+            phones_list[i] = p
+    except Exception as e:
+        print(f"Batch phonemization failed, falling back to per-job: {e}")
+    return phones_list
+
+def process_job_batch(job_files: List[Path]):
+    batch = load_job_batch(job_files)
+    phones_list = phonemize_batch(batch)
+    
+    for (job_file, job_data), phones in zip(batch, phones_list):
+        try:
+            success, message = process_job(job_data, phones)
+            
+            job_file.unlink()
+            
+            if success:
+                print(f"Completed job {job_data['id']}")
+            else:
+                print(f"Failed job {job_data['id']}: {message}")
+                
+        except Exception as e:
+            print(f"Error processing job file {job_file}: {e}")
+            try:
+                job_file.unlink()
+            except:
+                pass
+
+def detect_numa_nodes() -> List[List[int]]:
+    """CPUs of each NUMA node usable by this process, a single group when the host isn't NUMA"""
+    allowed = os.sched_getaffinity(0)
+    nodes = []
+    for cpulist in sorted(Path("/sys/devices/system/node").glob("node*/cpulist")):
+        cpus = []
+        for part in cpulist.read_text().strip().split(","):
+            if not part:
+                continue
+            start, _, end = part.partition("-")
+            cpus.extend(range(int(start), int(end or start) + 1))
+        cpus = [cpu for cpu in cpus if cpu in allowed]
+        if cpus:
+            nodes.append(cpus)
+    return nodes or [sorted(allowed)]
+
+def _serve_node(cpus: List[int], task_queue, ready_queue):
+    # Keep llama.cpp and torch threads on one memory controller
+    os.sched_setaffinity(0, cpus)
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(len(cpus))
+    torch.set_num_threads(len(cpus))
+    print(f"NeuTTS worker process {os.getpid()} pinned to CPUs {cpus}")
+    
+    try:
+        load_models(len(cpus))
+    except Exception as e:
+        ready_queue.put((os.getpid(), str(e)))
+        return
+    ready_queue.put((os.getpid(), None))
+    
+    while True:
+        batch = task_queue.get()
+        if batch is None:
+            return
+        process_job_batch(batch)
+
+def start_node_processes(numa_nodes: List[List[int]], task_queue, ready_queue) -> list:
+    """Start one process per NUMA node and wait until each has loaded its model"""
+    ctx = mp.get_context("fork")
+    processes = [
+        ctx.Process(target=_serve_node, args=(cpus, task_queue, ready_queue), daemon=True)
+        for cpus in numa_nodes
+    ]
+    for process in processes:
+        process.start()
+    
+    try:
+        ready = 0
+        while ready < len(processes):
+            try:
+                pid, error = ready_queue.get(timeout=5)
+            except queue.Empty:
+                # A child killed while loading (e.g. OOM) never reports, don't wait on it forever
+                if not all(process.is_alive() for process in processes):
+                    raise RuntimeError("NeuTTS worker process died while loading the model")
+                continue
+            if error:
+                raise RuntimeError(f"NeuTTS worker process {pid} failed to load the model: {error}")
+            ready += 1
+    except BaseException:
+        stop_node_processes(processes)
+        raise
+    return processes
+
+def stop_node_processes(processes: list):
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+    for process in processes:
+        process.join()
+
+def split_batches(job_files: List[Path], num_groups: int) -> List[List[Path]]:
+    # Spread pending jobs over the node processes instead of queueing them all behind one
+    size = max(1, min(JOB_BATCH_SIZE, -(-len(job_files) // num_groups)))
+    return [job_files[i:i + size] for i in range(0, len(job_files), size)]
+
 def main():
     print("Starting NeuTTS Worker...")
     print(f"Python path: {sys.path}")
     print(f"Current working directory: {os.getcwd()}")
     print(f"Files in /app: {os.listdir('/app')}")
     
+    numa_nodes = detect_numa_nodes()
+    processes = []
+    task_queue = None
+    
     try:
+        if len(numa_nodes) > 1:
+            # One process per NUMA node, each loads its own model pinned to that node's CPUs
+            print(f"Detected {len(numa_nodes)} NUMA nodes, starting one NeuTTS process per node")
+            ctx = mp.get_context("fork")
+            task_queue = ctx.Queue()
+            processes = start_node_processes(numa_nodes, task_queue, ctx.Queue())
+        else:
+            load_models()
+        # Only advertise the engine once every process has its model loaded
         write_worker_info()
     except Exception as e:
         print(f"Failed to initialize NeuTTS worker: {e}")
+        stop_node_processes(processes)
         return 1
     
+    # Exit through SystemExit on SIGTERM so the node processes get stopped too
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
     queue_dir = Path("/tmp/tts_queue/neutts")
     queue_dir.mkdir(parents=True, exist_ok=True)
     
+    ino = INotify()
+    ino.add_watch(str(queue_dir), flags.CLOSE_WRITE | flags.MOVED_TO)
+    
+    # Jobs that landed before the watch was installed won't produce events
+    pending: "OrderedDict[Path, None]" = OrderedDict(
+        (p, None) for p in sorted(queue_dir.glob("job_*.json"), key=lambda p: p.stat().st_mtime)
+    )
+    
     print("NeuTTS Worker ready. Monitoring for jobs...")
     
     while True:
         try:
-            job_files = list(queue_dir.glob("job_*.json"))
+            # Block for new files only when nothing is pending, otherwise just drain what's queued up
+            events = ino.read(timeout=0 if pending else 1000)
+            for event in events:
+                if event.name.startswith("job_") and event.name.endswith(".json"):
+                    pending[queue_dir / event.name] = None
             
-            for job_file in job_files:
-                try:
-                    with open(job_file, 'r') as f:
-                        job_data = json.load(f)
-                    
-                    success, message = process_job(job_data)
-                    
-                    job_file.unlink()
-                    
-                    if success:
-                        print(f"Completed job {job_data['id']}")
-                    else:
-                        print(f"Failed job {job_data['id']}: {message}")
-                        
-                except Exception as e:
-                    print(f"Error processing job file {job_file}: {e}")
-                    try:
-                        job_file.unlink()
-                    except:
-                        pass
+            if processes and not all(process.is_alive() for process in processes):
+                # Queued jobs stay on disk, the restarted worker picks them up in its startup scan
+                print("A NeuTTS worker process died, shutting down")
+                stop_node_processes(processes)
+                return 1
             
-            time.sleep(0.1)
+            if pending and processes:
+                job_files = [p for p in pending if p.exists()]
+                pending.clear()
+                for batch in split_batches(job_files, len(processes)):
+                    task_queue.put(batch)
+            elif pending:
+                batch = list(pending)[:JOB_BATCH_SIZE]
+                for job_file in batch:
+                    del pending[job_file]
+                process_job_batch([p for p in batch if p.exists()])
             
         except KeyboardInterrupt:
             print("NeuTTS Worker shutting down...")
+            stop_node_processes(processes)
             break
         except Exception as e:
             print(f"Unexpected error in NeuTTS worker: {e}")